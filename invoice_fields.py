@@ -0,0 +1,7 @@
+"""Conventions for extracted invoice fields shared by the dashboard (main.py) and the PDF report."""
+
+# Values Gemini (or a user editing the store) uses for a missing field, compared after stripping whitespace
+NA_TOKENS = frozenset({'NA', '', 'na', 'N/A', None})
+
+# First number in a delivery charge string such as "Rs. 120.50" (named, since pyarrow's extract_regex requires it)
+NUMBER_PATTERN = r'(?P<number>\d+(?:\.\d+)?)'
@@ -1,29 +1,90 @@
 import streamlit as st
 import json
 import pandas as pd
+import numpy as np
 import datetime
 import time
-import google.generativeai as genai
+import random
 import os
-from dotenv import load_dotenv
-import tempfile
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import re
 import zipfile
 import io
-from pdf_report_generator import generate_pdf_report, create_download_link
+import hashlib
+import uuid
+import shelve
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from invoice_fields import NA_TOKENS, NUMBER_PATTERN
 
-# ------------------------------------------------------------------------------
-# 1. Loading API key from .env
-API_KEY = st.secrets["api_key"]["GEMINI_API_KEY"]
+# Heavy libraries (google.generativeai, plotly, fpdf via pdf_report_generator) are imported
+# where they are used so a session start doesn't pay for the ones it never touches.
 
-genai.configure(api_key=API_KEY)
+# Default number of PDFs sent to Gemini concurrently (adjustable in the upload tab)
+MAX_WORKERS = 8
 
-def extract_field(pdf_file):
-    """Save PDF temporarily and send it to Gemini to extract invoice number, sender pincode, receiver pincode, delivery/shipment charges, and main date in pure JSON format."""
-    prompt = """Analyze this PDF and extract invoice number, sender pincode, receiver pincode, delivery/shipment charges, and a main date in pure JSON format with keys invoice_number, sender_pincode, receiver_pincode, delivery_charge, main_date.
+# On-disk cache of Gemini extractions keyed by PDF content hash
+GEMINI_CACHE_FILE = ".gemini_cache"
+
+# Gemini free-tier request quota, shared by all extraction threads
+GEMINI_RPM = 15
+
+# Gemini's limit for a whole inline request is 20 MB; larger PDFs go through the File API
+INLINE_PDF_LIMIT = 18 * 1024 * 1024
+
+_JSON_DECODER = json.JSONDecoder()
+
+# First number in a delivery charge string such as "Rs. 120.50"
+_NUM_RE = re.compile(NUMBER_PATTERN)
+
+# Extracted invoice data is an append-only directory of Parquet parts (one per upload batch);
+# Excel is only produced for downloads. Older single-file stores are migrated on first append.
+OUTPUT_DIR = "invoice_data"
+LEGACY_DATA_FILES = ("invoice.parquet", "invoice.xlsx")
+DATA_COLUMNS = ['File Name', 'Invoice Number', 'Delivery/Shipment Charges', 'Main Date', 'Sender Pincode', 'Receiver Pincode']
+
+# Maximum number of points sent to the browser for the orders time series
+MAX_PLOT_POINTS = 2000
+
+# Minimum seconds between progress bar updates while extracting (each update is a message to the browser)
+PROGRESS_INTERVAL = 0.1
+
+# Rows per page in the dashboard's raw data table
+RAW_DATA_PAGE_SIZE = 100
+
+# Bounds on the data caches, which would otherwise keep an entry for every data version and date range ever seen.
+# Full-length data is kept for the current and previous version; summaries for the last few date ranges picked.
+DATA_CACHE_ENTRIES = 2
+SUMMARY_CACHE_ENTRIES = 8
+
+class RateLimiter:
+    """Spaces out calls from any number of threads to at most rpm per minute."""
+    
+    def __init__(self, rpm):
+        self.min_interval = 60.0 / rpm
+        self.next_time = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until the caller's turn. Slots are reserved under the lock, the wait happens outside it."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.min_interval
+        time.sleep(wait)
+
+@st.cache_resource
+def gemini_rate_limiter(rpm):
+    """Return the process-wide RateLimiter for Gemini requests.
+    
+    cache_resource makes every session and rerun share one limiter, so concurrent uploads split the quota
+    instead of each getting its own.
+    """
+    return RateLimiter(rpm=rpm)
+
+# Extraction instructions sent with every PDF
+_PROMPT = """Analyze this PDF and extract invoice number, sender pincode, receiver pincode, delivery/shipment charges, and a main date in pure JSON format with keys invoice_number, sender_pincode, receiver_pincode, delivery_charge, main_date.
 
     IMPORTANT INSTRUCTIONS:
     
@@ -65,224 +126,501 @@ def extract_field(pdf_file):
     - Extract 6-digit pincodes from addresses
     - If sender or receiver pincode not found, put "NA" for that field
 
-    Provide ONLY the raw JSON and nothing else with keys: invoice_number, sender_pincode, receiver_pincode, delivery_charge, main_date"""    
+    Provide ONLY the raw JSON and nothing else with keys: invoice_number, sender_pincode, receiver_pincode, delivery_charge, main_date"""
+
+@st.cache_resource
+def get_gemini_model():
+    """Configure Gemini with the API key from Streamlit secrets on first use and return the model.
+    
+    Cached per process with cache_resource, like the rate limiter, so reruns and sessions reuse it.
+    """
+    import google.generativeai as genai
+    
+    genai.configure(api_key=st.secrets["api_key"]["GEMINI_API_KEY"])
+    return genai.GenerativeModel('gemini-1.5-flash')  # Free and faster
+
+def is_retryable_error(error):
+    """Return True for Gemini errors worth retrying: rate limiting (429) and server-side (5xx) failures."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    message = str(error).upper()
+    return any(token in message for token in ('429', 'RESOURCE_EXHAUSTED', 'QUOTA'))
+
+def retry_delay_seconds(error):
+    """Return the retry delay the server asked for in a Gemini error, or None if it gave none."""
+    for detail in getattr(error, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+def _call_with_backoff(fn, max_attempts=5):
+    """Call fn, retrying retryable Gemini errors with exponential backoff (1s, 2s, 4s, ... capped at 32s).
+    
+    A server-provided retry delay takes precedence over the backoff. Any other error is raised immediately.
+    """
+    delay = 1
+    for attempt in range(max_attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_attempts - 1 or not is_retryable_error(e):
+                raise
+            wait = retry_delay_seconds(e) or delay + random.random()
+            st.warning(f"⚠️ Gemini request failed (attempt {attempt + 1}), retrying in {wait:.1f}s: {e}")
+            time.sleep(wait)
+            delay = min(delay * 2, 32)
+
+def pdf_digest(pdf_bytes):
+    """Return the content hash that keys a PDF in the extraction cache."""
+    return hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+
+@st.cache_resource
+def gemini_cache_lock():
+    """Return the lock guarding the extraction cache file.
+    
+    Streamlit re-runs this script in a fresh module for every session and rerun, so the lock is created once per
+    process via cache_resource; a module-level lock would only serialize threads of a single script run.
+    """
+    return threading.Lock()
+
+def load_cached_fields(cache_keys):
+    """Return {cache_key: fields} for the given keys that are already in the extraction cache.
+    
+    The cache is best-effort: if it can't be read, every PDF is simply sent to Gemini.
+    """
+    try:
+        with gemini_cache_lock(), shelve.open(GEMINI_CACHE_FILE) as cache:
+            return {key: cache[key] for key in cache_keys if key in cache}
+    except Exception as e:
+        st.warning(f"⚠️ Could not read the extraction cache: {e}")
+        return {}
+
+def extract_field(pdf_bytes, cache_key):
+    """Send PDF bytes to Gemini to extract invoice number, sender pincode, receiver pincode, delivery/shipment charges, and main date in pure JSON format."""
+    import google.generativeai as genai
     
-    model = genai.GenerativeModel('gemini-1.5-flash')  # Free and faster
+    # Callers check the cache first (see load_cached_fields); successful extractions are stored under cache_key
+    limiter = gemini_rate_limiter(GEMINI_RPM)
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(pdf_file.read())  # write the uploaded file's content
-        tmp_file_path = tmp_file.name
+    def request():
+        if len(pdf_bytes) <= INLINE_PDF_LIMIT:
+            # Small PDFs go inline with the prompt - no temp file and no separate upload call
+            pdf_part = {"mime_type": "application/pdf", "data": pdf_bytes}
+        else:
+            limiter.acquire()
+            pdf_part = genai.upload_file(io.BytesIO(pdf_bytes), mime_type="application/pdf")
+        limiter.acquire()
+        return model.generate_content([_PROMPT, pdf_part])
 
-    for attempt in range(5):
-        try:
-            response = model.generate_content([prompt, genai.upload_file(tmp_file_path)])
+    try:
+        # Inside the try so a missing or invalid API key falls back to NA for this file like any other failure
+        model = get_gemini_model()
+        response = _call_with_backoff(request)
 
-            raw = response.text
-            start = raw.find('{')
-            end = raw.rfind('}')
-            if start == -1 or end == -1:
-                raise ValueError("Invalid format.")
-            raw_json = raw[start:end+1]
-            return json.loads(raw_json)
+        # Decode the first JSON object in the reply, ignoring any surrounding text
+        raw = response.text
+        start = raw.find('{')
+        if start == -1:
+            raise ValueError("Invalid format.")
+        fields, _ = _JSON_DECODER.raw_decode(raw, start)
 
-        except Exception as e:
-            st.error(f"Error retrieving from Gemini (attempt {attempt + 1}): {e}")
-            time.sleep(30)  # Wait and retry
+    except Exception as e:
+        st.error(f"Error retrieving from Gemini: {e}")
+        return {"invoice_number": "NA", "sender_pincode": "NA", "receiver_pincode": "NA", "delivery_charge": "NA", "main_date": "NA"}
+    
+    # A failed cache write only costs a repeat request later; the extraction itself is still returned
+    try:
+        with gemini_cache_lock(), shelve.open(GEMINI_CACHE_FILE) as cache:
+            cache[cache_key] = fields
+    except Exception as e:
+        st.warning(f"⚠️ Could not cache the extraction for this PDF: {e}")
     
-    return {"invoice_number": "NA", "sender_pincode": "NA", "receiver_pincode": "NA", "delivery_charge": "NA", "main_date": "NA"}
+    return fields
+
+def pdf_entries(zip_ref):
+    """Return the ZipInfo entries of the PDF files in an open ZIP file."""
+    return [file_info for file_info in zip_ref.infolist()
+            if file_info.filename.lower().endswith('.pdf') and not file_info.is_dir()]
 
-def extract_pdfs_from_zip(zip_file):
-    """Extract all PDF files from a ZIP file and return them as a list of file-like objects."""
-    pdf_files = []
+def count_pdfs_in_zip(zip_file):
+    """Count the PDF files in a ZIP file. Only the archive's directory is read."""
+    try:
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            return len(pdf_entries(zip_ref))
     
+    except Exception as e:
+        st.error(f"Error extracting ZIP file: {e}")
+        return 0
+
+def iter_pdfs_from_zip(zip_file):
+    """Yield (name, bytes) for each PDF file in a ZIP file, decompressing one PDF at a time."""
     try:
+        zip_file.seek(0)
         with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-            for file_info in zip_ref.infolist():
-                if file_info.filename.lower().endswith('.pdf') and not file_info.is_dir():
-                    # Extract the PDF file content
-                    pdf_content = zip_ref.read(file_info.filename)
-                    
-                    # Create a file-like object
-                    pdf_file_obj = io.BytesIO(pdf_content)
-                    pdf_file_obj.name = file_info.filename
-                    
-                    pdf_files.append(pdf_file_obj)
-        
-        return pdf_files
+            for file_info in pdf_entries(zip_ref):
+                with zip_ref.open(file_info) as pdf_file:
+                    yield file_info.filename, pdf_file.read()
     
     except Exception as e:
         st.error(f"Error extracting ZIP file: {e}")
-        return []
+
+def iter_pdf_contents(sources):
+    """Yield (name, bytes) for each source, which is either a PDF upload or a ZIP upload to expand."""
+    for uploaded_file, is_zip in sources:
+        if is_zip:
+            yield from iter_pdfs_from_zip(uploaded_file)
+        else:
+            uploaded_file.seek(0)
+            yield uploaded_file.name, uploaded_file.read()
 
 def process_uploaded_files(uploaded_files):
-    """Process uploaded files (PDFs and ZIP files containing PDFs)."""
-    all_pdf_files = []
+    """Process uploaded files (PDFs and ZIP files containing PDFs).
+    
+    Returns the number of PDFs found and a generator of (name, bytes) pairs that reads them one at a time,
+    so a large archive is never held in memory all at once.
+    """
+    sources = []
+    total_pdfs = 0
     
     for uploaded_file in uploaded_files:
         if uploaded_file.name.lower().endswith('.pdf'):
             # Direct PDF file
-            all_pdf_files.append(uploaded_file)
+            sources.append((uploaded_file, False))
+            total_pdfs += 1
         elif uploaded_file.name.lower().endswith('.zip'):
             # ZIP file containing PDFs
             st.info(f"📦 Extracting PDFs from {uploaded_file.name}...")
-            pdf_files_from_zip = extract_pdfs_from_zip(uploaded_file)
-            if pdf_files_from_zip:
-                all_pdf_files.extend(pdf_files_from_zip)
-                st.success(f"✅ Extracted {len(pdf_files_from_zip)} PDF files from {uploaded_file.name}")
+            pdf_count = count_pdfs_in_zip(uploaded_file)
+            if pdf_count:
+                sources.append((uploaded_file, True))
+                total_pdfs += pdf_count
+                st.success(f"✅ Extracted {pdf_count} PDF files from {uploaded_file.name}")
             else:
                 st.warning(f"⚠️ No PDF files found in {uploaded_file.name}")
         else:
             st.warning(f"⚠️ Unsupported file type: {uploaded_file.name}")
     
-    return all_pdf_files
+    return total_pdfs, iter_pdf_contents(sources)
+
+def extract_invoices(pdf_contents, total_pdfs, max_workers, progress_bar, status_text):
+    """Extract fields for each (name, bytes) pair on a thread pool and return (file_names, results) in upload order.
+    
+    Identical PDFs (re-uploads, the same invoice in several ZIPs) are only sent to Gemini once, and PDFs
+    extracted in an earlier run come straight from the cache, looked up once per window of 2 * max_workers
+    uploads. At most one window plus 2 * max_workers PDFs waiting for Gemini are held in memory; submitting
+    more waits for one of them to finish.
+    """
+    file_names = []
+    cache_keys = []
+    files_per_key = Counter()
+    extracted = {}
+    submitted_names = {}  # cache key -> first file submitted with that content
+    futures = {}
+    completed = 0
+    last_update = 0.0
+    
+    def finish(future):
+        nonlocal completed, last_update
+        key = futures.pop(future)
+        extracted[key] = future.result()
+        # Files sharing this content were waiting on the same future
+        completed += files_per_key[key]
+        now = time.monotonic()
+        if now - last_update >= PROGRESS_INTERVAL or completed >= total_pdfs:
+            status_text.text(f"Processed {submitted_names[key]} ({completed}/{total_pdfs})")
+            progress_bar.progress(min(completed / total_pdfs, 1.0))
+            last_update = now
+    
+    def submit_window(executor, window):
+        nonlocal completed
+        # One cache read for the whole window instead of a shelve open per PDF
+        lookup = {key for _, _, key in window if key not in extracted and key not in submitted_names}
+        if lookup:
+            extracted.update(load_cached_fields(lookup))
+        
+        for file_name, content, key in window:
+            files_per_key[key] += 1
+            if key in extracted:
+                completed += 1
+                continue
+            if key in submitted_names:
+                continue  # counted when its content's future completes
+            
+            submitted_names[key] = file_name
+            futures[executor.submit(extract_field, content, key)] = key
+            if len(futures) >= 2 * max_workers:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+    
+    # Gemini calls are network-bound, so run them on a thread pool. Worker threads
+    # get the script run context so st.error/st.warning inside extract_field still render.
+    # Uploads are read here on the main thread - uploaded file objects are not thread-safe.
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+        window = []
+        for file_name, content in pdf_contents:
+            key = pdf_digest(content)
+            file_names.append(file_name)
+            cache_keys.append(key)
+            window.append((file_name, content, key))
+            if len(window) >= 2 * max_workers:
+                submit_window(executor, window)
+                window = []
+        submit_window(executor, window)
+        
+        for future in as_completed(list(futures)):
+            finish(future)
+    
+    progress_bar.progress(1.0)
+    if len(file_names) > len(submitted_names):
+        st.info(f"♻️ Reused earlier extractions for {len(file_names) - len(submitted_names)} files")
+    return file_names, [extracted[key] for key in cache_keys]
 
-def check_duplicate_invoice(filename, invoice_number):
-    """Check if invoice number already exists in the Excel file."""
+def data_parts(data_dir):
+    """Return the sorted Parquet part files in the data directory."""
+    if not os.path.isdir(data_dir):
+        return []
+    return sorted(f for f in os.listdir(data_dir) if f.endswith('.parquet') and not f.startswith('.'))
+
+def read_legacy_data():
+    """Read the first legacy single-file store that exists. Returns None if there is none."""
+    for path in LEGACY_DATA_FILES:
+        if os.path.exists(path):
+            return pd.read_parquet(path) if path.endswith('.parquet') else pd.read_excel(path)
+    return None
+
+def read_data_file(data_dir):
+    """Read stored invoice data, falling back to the legacy single-file stores. Returns None if there is no data."""
+    if data_parts(data_dir):
+        return pd.read_parquet(data_dir)
+    return read_legacy_data()
+
+def write_data_part(data_dir, df):
+    """Write df as a new Parquet part in the data directory and return its path."""
+    os.makedirs(data_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    part_name = f"part-{timestamp}-{uuid.uuid4().hex[:8]}.parquet"
+    part_path = os.path.join(data_dir, part_name)
+    # Write under a hidden name (skipped by data_parts) and rename, so a crash never leaves a half-written part
+    tmp_path = os.path.join(data_dir, f".{part_name}.tmp")
     try:
-        if os.path.exists(filename) and invoice_number != "NA" and invoice_number != "":
-            existing_df = pd.read_excel(filename)
-            if 'Invoice Number' in existing_df.columns:
-                # Check for duplicate invoice numbers (case-insensitive)
-                existing_invoices = existing_df['Invoice Number'].astype(str).str.upper()
-                return invoice_number.upper() in existing_invoices.values
-        return False
-    except Exception as e:
-        st.error(f"Error checking duplicates: {str(e)}")
-        return False
+        # Store everything as text so Gemini's mixed types round-trip and all parts share one schema
+        df.astype('string').to_parquet(tmp_path, index=False, compression='zstd')
+        os.replace(tmp_path, part_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return part_path
+
+def build_invoice_index(df):
+    """Return the set of stored invoice numbers, upper-cased for case-insensitive duplicate checks."""
+    return set(df['Invoice Number'].dropna().astype(str).str.upper())
 
 def append_to_file(filename, new_df):
-    """Append new data to an existing Excel file or create it if it doesn't exist."""
-    max_attempts = 5
-    
-    for attempt in range(max_attempts):
-        try:
-            if os.path.exists(filename):
-                existing_df = pd.read_excel(filename)
-                df = pd.concat([existing_df, new_df], ignore_index=True)
-            else:
-                df = new_df
-            
-            # Try to save the file
-            df.to_excel(filename, index=False)
-            return df
-            
-        except PermissionError:
-            if attempt < max_attempts - 1:
-                st.warning(f"⚠️ Cannot access '{filename}'. Please close the file if it's open in Excel or another program. Retrying in 3 seconds... (Attempt {attempt + 1}/{max_attempts})")
-                time.sleep(3)
-            else:
-                # Final attempt - try with a different filename
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                backup_filename = f"invoice_backup_{timestamp}.xlsx"
-                st.error(f"❌ Could not save to '{filename}'. Saving as '{backup_filename}' instead.")
-                
-                try:
-                    if os.path.exists(filename):
-                        existing_df = pd.read_excel(filename)
-                        df = pd.concat([existing_df, new_df], ignore_index=True)
-                    else:
-                        df = new_df
-                    
-                    df.to_excel(backup_filename, index=False)
-                    st.success(f"✅ Data saved successfully as '{backup_filename}'")
-                    return df
-                    
-                except Exception as e:
-                    st.error(f"❌ Failed to save file: {str(e)}")
-                    return new_df
-                    
-        except Exception as e:
-            st.error(f"❌ Unexpected error while saving file: {str(e)}")
-            return new_df
+    """Append new data as a new part in the data directory, creating it (and migrating legacy data) if needed.
     
-    return new_df
-
-def extract_numeric_value(delivery_charge):
-    """Extract numeric value from delivery charge string."""
-    if pd.isna(delivery_charge) or delivery_charge == "NA":
-        return 0
+    Only the new batch is written, so the cost does not grow with the stored history. Returns True if it was saved.
+    """
+    try:
+        if not data_parts(filename):
+            legacy_df = read_legacy_data()
+            if legacy_df is not None:
+                write_data_part(filename, legacy_df)
+        
+        write_data_part(filename, new_df)
     
-    # Convert to string if not already
-    delivery_str = str(delivery_charge)
+    except Exception as e:
+        st.error(f"❌ Failed to save data to '{filename}': {str(e)}")
+        return False
     
-    # Remove currency symbols and extract numbers
-    numbers = re.findall(r'\d+\.?\d*', delivery_str)
-    if numbers:
-        return float(numbers[0])
-    return 0
-
-def load_existing_data(filename):
-    """Load existing data from Excel file with error handling."""
+    return True
+
+def na_mask(s):
+    """Return a boolean mask of missing values in s (nulls and NA tokens, ignoring surrounding whitespace)."""
+    s2 = s.astype('string').str.strip()
+    return s2.isna() | s2.isin(NA_TOKENS)
+
+def normalize_pincode(pincode):
+    """Drop the trailing .0 that Excel adds to numeric pincodes."""
+    # isdecimal, unlike isdigit, only accepts characters float() can parse (not e.g. superscripts)
+    if pincode.replace('.', '', 1).isdecimal() and float(pincode).is_integer():
+        return str(int(float(pincode)))
+    return pincode
+
+def normalize_pincodes(pincodes):
+    """Return a pincode column stripped and normalized as a categorical, calling normalize_pincode once per distinct value."""
+    pincodes = pincodes.astype('string').str.strip().astype('category')
+    # Normalizing can merge categories ('600042.0' and '600042'), so the codes are remapped rather than the categories renamed
+    recode, categories = pd.factorize(pincodes.cat.categories.map(normalize_pincode))
+    # The trailing -1 keeps missing values (code -1) missing
+    codes = np.append(recode, -1)[pincodes.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=pincodes.index, name=pincodes.name)
+
+def data_file_mtime(filename):
+    """Return the modification time of what read_data_file would load, used to key the data caches.
+    
+    A directory's mtime changes whenever a part is added to it.
+    """
+    if data_parts(filename):
+        return os.path.getmtime(filename)
+    for path in LEGACY_DATA_FILES:
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+    return None
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES)
+def load_existing_data(filename, mtime):
+    """Load existing data from the Parquet data directory (or a legacy file) with error handling. Cached per mtime."""
     try:
-        if os.path.exists(filename):
-            return pd.read_excel(filename)
+        existing_df = read_data_file(filename)
+        if existing_df is not None:
+            # Pincodes are a small set of values repeated many times - keep them as categoricals
+            for pincode_column in ('Sender Pincode', 'Receiver Pincode'):
+                existing_df[pincode_column] = normalize_pincodes(existing_df[pincode_column])
+            # Parse 'Main Date' (DD-MM-YYYY) once per load; the dashboard and the PDF report reuse it
+            existing_df['Date'] = pd.to_datetime(existing_df['Main Date'], format='%d-%m-%Y', errors='coerce', cache=True)
+            return existing_df
         else:
-            return pd.DataFrame(columns=['File Name', 'Invoice Number', 'Delivery/Shipment Charges', 'Main Date', 'Sender Pincode', 'Receiver Pincode'])
+            return pd.DataFrame(columns=DATA_COLUMNS)
     except PermissionError:
-        st.error(f"❌ Cannot read '{filename}'. Please close the file if it's open in Excel.")
-        return pd.DataFrame(columns=['File Name', 'Invoice Number', 'Delivery/Shipment Charges', 'Main Date', 'Sender Pincode', 'Receiver Pincode'])
+        st.error(f"❌ Cannot read '{filename}'. Please close the file if it's open in another program.")
+        return pd.DataFrame(columns=DATA_COLUMNS)
     except Exception as e:
         st.error(f"❌ Error reading file: {str(e)}")
-        return pd.DataFrame(columns=['File Name', 'Invoice Number', 'Delivery/Shipment Charges', 'Main Date', 'Sender Pincode', 'Receiver Pincode'])
-
-def create_pincode_analysis(df, pincode_column, title_prefix):
-    """Create pincode analysis for either sender or receiver pincodes."""
-    # Filter out NA pincodes for analysis - improved NA detection
-    valid_pincodes_mask = ((df[pincode_column] != 'NA') & 
-                          (~df[pincode_column].isna()) & 
-                          (df[pincode_column] != '') &
-                          (df[pincode_column].astype(str).str.strip() != 'NA'))
-    valid_pincodes = df[valid_pincodes_mask][pincode_column]
-    
-    if not valid_pincodes.empty:
-        # Convert pincodes to string and clean them
-        valid_pincodes = valid_pincodes.astype(str).str.strip()
-        # Convert to integer (remove .0 if present)
-        valid_pincodes = valid_pincodes.apply(lambda x: str(int(float(x))) if x.replace('.', '', 1).isdigit() and float(x).is_integer() else x)
-        pincode_counts = valid_pincodes.value_counts()
+        return pd.DataFrame(columns=DATA_COLUMNS)
+
+def lttb_indices(x, y, n_out):
+    """Pick n_out point indices with Largest-Triangle-Three-Buckets so a downsampled line keeps its shape."""
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # First and last points are always kept; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i < n_out - 3 else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Keep the point forming the largest triangle with the previous pick and the next bucket's average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    
+    return selected
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES)
+def parse_delivery_charges(_charges, cache_key):
+    """Return (numeric charges, missing mask) for 'Delivery/Shipment Charges' values. cache_key identifies the Series."""
+    numeric = pd.to_numeric(_charges.astype('string').str.extract(_NUM_RE, expand=False), errors='coerce').fillna(0.0)
+    return numeric, na_mask(_charges)
+
+# Two entries (sender and receiver) per date range
+@st.cache_data(show_spinner=False, max_entries=2 * SUMMARY_CACHE_ENTRIES)
+def top_pincodes(_pincodes, cache_key, n=10):
+    """Return order counts of the n most frequent valid pincodes. cache_key identifies the (filtered) Series."""
+    # Count first and drop NA tokens from the (few) distinct values, rather than masking every row
+    pincode_counts = _pincodes.value_counts()
+    valid = ~na_mask(pincode_counts.index.to_series()).to_numpy()
+    # Categorical value_counts also lists categories with no rows left after filtering
+    pincode_counts = pincode_counts[valid & (pincode_counts.to_numpy() > 0)]
+    return pincode_counts.head(n)
+
+@st.cache_data(show_spinner=False, max_entries=SUMMARY_CACHE_ENTRIES)
+def summarize_charges(_charges, cache_key, bins=20):
+    """Return histogram counts and edges plus box plot statistics for positive charges. cache_key identifies the Series."""
+    values = _charges.to_numpy(dtype=float)
+    counts, edges = np.histogram(values, bins=bins)
+    q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+    # Whiskers end at the most extreme values within 1.5 IQR of the box, as in a regular box plot
+    iqr = q3 - q1
+    lowerfence = values[values >= q1 - 1.5 * iqr].min()
+    upperfence = values[values <= q3 + 1.5 * iqr].max()
+    stats = {'mean': values.mean(), 'min': values.min(), 'max': values.max(),
+             'q1': q1, 'median': median, 'q3': q3, 'lowerfence': lowerfence, 'upperfence': upperfence}
+    return counts, edges, stats
+
+@st.cache_data(show_spinner=False, max_entries=SUMMARY_CACHE_ENTRIES)
+def summarize_by_date(_df, cache_key):
+    """Return (daily order counts, monthly summary) for the rows of _df with a parsed Date. cache_key identifies _df."""
+    # Select only the rows and columns the time series needs; on a cache hit this copy is skipped entirely
+    df_with_dates = _df.loc[_df['Date'].notna(), ['Date', 'Numeric_Delivery_Charge', 'File Name']]
+    
+    # Dense daily order counts (days without orders are 0) via the DatetimeIndex resampler
+    daily_orders = df_with_dates.resample('D', on='Date').size().rename('Orders').reset_index()
+    
+    # Monthly summary in one resample pass; months without orders are left out of the table
+    monthly_summary = df_with_dates.resample('MS', on='Date').agg({
+        'File Name': 'count',
+        'Numeric_Delivery_Charge': 'sum'
+    }).rename(columns={'File Name': 'Orders', 'Numeric_Delivery_Charge': 'Total_Delivery'})
+    monthly_summary = monthly_summary[monthly_summary['Orders'] > 0]
+    monthly_summary.index = monthly_summary.index.to_period('M').rename('Month')
+    return daily_orders, monthly_summary
+
+def create_pincode_analysis(df, pincode_column, title_prefix, cache_key):
+    """Create pincode analysis for either sender or receiver pincodes. cache_key identifies the filtered df."""
+    import plotly.graph_objects as go
+    
+    # Count valid pincodes only (the column is a cleaned categorical, see load_existing_data)
+    top10 = top_pincodes(df[pincode_column], (cache_key, pincode_column))
+    
+    if not top10.empty:
+        # Materialize the top 10 once; the chart, the top 5 list and the winner all slice it
+        top10_idx = top10.index.to_list()
+        top10_vals = top10.values
         
         col1, col2 = st.columns([2, 1])
         
         with col1:
-            # Create bar chart for pincode distribution with proper formatting
-            fig_bar = px.bar(
-                x=pincode_counts.index[:10],  # Top 10 pincodes
-                y=pincode_counts.values[:10],
-                title=f"Top 10 {title_prefix} Pincodes by Order Count",
-                labels={'x': 'Pincode', 'y': 'Number of Orders'},
-                color=pincode_counts.values[:10],
-                color_continuous_scale='viridis',
-                text=pincode_counts.values[:10]  # Show values on bars
-            )
+            # Create bar chart for pincode distribution (plain go.Bar; px.bar builds an intermediate DataFrame)
+            fig_bar = go.Figure(go.Bar(
+                x=top10_idx,  # Top 10 pincodes
+                y=top10_vals,
+                text=top10_vals,  # Show values on bars
+                texttemplate='%{text}',
+                textposition='outside',
+                marker={'color': top10_vals, 'colorscale': 'viridis'}
+            ))
             
             # Format the x-axis to show pincodes as strings without scientific notation
             fig_bar.update_layout(
+                title=f"Top 10 {title_prefix} Pincodes by Order Count",
                 xaxis_title="Pincode",
                 yaxis_title="Number of Orders",
                 showlegend=False,
-                xaxis={'type': 'category', 'tickmode': 'array', 'tickvals': pincode_counts.index[:10], 'ticktext': pincode_counts.index[:10]}
+                xaxis={'type': 'category', 'tickmode': 'array', 'tickvals': top10_idx, 'ticktext': top10_idx}
             )
             
-            # Add text on bars
-            fig_bar.update_traces(texttemplate='%{text}', textposition='outside')
-            
             st.plotly_chart(fig_bar, use_container_width=True)
         
         with col2:
             st.write(f"**Top 5 {title_prefix} Pincodes:**")
-            for i, (pincode, count) in enumerate(pincode_counts.head().items(), 1):
+            for i, (pincode, count) in enumerate(zip(top10_idx[:5], top10_vals[:5]), 1):
                 st.write(f"{i}. **{pincode}**: {count} orders")
             
             # Most frequent pincode
-            most_frequent_pincode = pincode_counts.index[0]
-            most_frequent_count = pincode_counts.iloc[0]
+            most_frequent_pincode = top10_idx[0]
+            most_frequent_count = top10_vals[0]
             st.success(f"🏆 Most frequent {title_prefix.lower()} pincode: **{most_frequent_pincode}** ({most_frequent_count} orders)")
     
     else:
         st.warning(f"No valid {title_prefix.lower()} pincodes found in the data.")
 
-def create_dashboard(df):
-    """Create dashboard with analytics and visualizations."""
+def create_dashboard(df, cache_key):
+    """Create dashboard with analytics and visualizations. cache_key identifies the loaded data for cached aggregations."""
+    import plotly.express as px
+    import plotly.graph_objects as go
+    
     st.header("📊 Dashboard Analytics")
     
     if df.empty:
@@ -292,54 +630,42 @@ def create_dashboard(df):
     # Date range filter
     st.subheader("📅 Filter by Date Range")
     
-    # Convert dates and get valid date range
-    df_with_valid_dates = df[df['Main Date'] != 'NA'].copy()
+    # Dates are parsed by load_existing_data; parse charges once per data load too. The filters and charts below reuse both
+    df['Numeric_Delivery_Charge'], charge_missing = parse_delivery_charges(df['Delivery/Shipment Charges'], cache_key)
+    dated_mask = df['Date'].notna()
+    filter_key = (cache_key, None, None)
     
-    if not df_with_valid_dates.empty:
-        try:
-            df_with_valid_dates['Date'] = pd.to_datetime(df_with_valid_dates['Main Date'], format='%d-%m-%Y', errors='coerce')
-            df_with_valid_dates = df_with_valid_dates.dropna(subset=['Date'])
+    if dated_mask.any():
+        min_date = df['Date'].min().date()
+        max_date = df['Date'].max().date()
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("Start Date", value=min_date, min_value=min_date, max_value=max_date)
+        with col2:
+            end_date = st.date_input("End Date", value=max_date, min_value=min_date, max_value=max_date)
+        
+        # Filter dataframe based on date range
+        if start_date and end_date:
+            # Compare as timestamps (NaT never matches) and take one selection, no intermediate copies
+            date_range_mask = (df['Date'] >= pd.Timestamp(start_date)) & (df['Date'] <= pd.Timestamp(end_date))
             
-            if not df_with_valid_dates.empty:
-                min_date = df_with_valid_dates['Date'].min().date()
-                max_date = df_with_valid_dates['Date'].max().date()
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    start_date = st.date_input("Start Date", value=min_date, min_value=min_date, max_value=max_date)
-                with col2:
-                    end_date = st.date_input("End Date", value=max_date, min_value=min_date, max_value=max_date)
-                
-                # Filter dataframe based on date range
-                if start_date and end_date:
-                    mask = (df_with_valid_dates['Date'].dt.date >= start_date) & (df_with_valid_dates['Date'].dt.date <= end_date)
-                    filtered_df = df_with_valid_dates[mask]
-                    
-                    # Update main dataframe with filtered data
-                    if not filtered_df.empty:
-                        df = filtered_df
-                        st.success(f"📊 Showing data from {start_date} to {end_date} ({len(df)} records)")
-                    else:
-                        st.warning("No data found in the selected date range.")
-                        return
+            # Update main dataframe with filtered data
+            if date_range_mask.any():
+                df = df.loc[date_range_mask]
+                filter_key = (cache_key, start_date, end_date)
+                st.success(f"📊 Showing data from {start_date} to {end_date} ({len(df)} records)")
             else:
-                st.info("📅 No valid dates found. Showing all data.")
-        except:
-            st.info("📅 No valid dates found. Showing all data.")
+                st.warning("No data found in the selected date range.")
+                return
     else:
-        st.info("📅 No dates available in data. Showing all data.")
+        st.info("📅 No valid dates found. Showing all data.")
     
     st.divider()
     
-    # Process delivery charges
-    df['Numeric_Delivery_Charge'] = df['Delivery/Shipment Charges'].apply(extract_numeric_value)
-    
     # Calculate metrics - properly detect NA values
     total_delivery_spent = df['Numeric_Delivery_Charge'].sum()
-    na_count = ((df['Delivery/Shipment Charges'] == 'NA') | 
-                (df['Delivery/Shipment Charges'].isna()) | 
-                (df['Delivery/Shipment Charges'] == '') |
-                (df['Delivery/Shipment Charges'].astype(str).str.strip() == 'NA')).sum()
+    na_count = int(charge_missing.loc[df.index].sum())
     total_orders = len(df)
     
     # Create metrics row
@@ -374,13 +700,13 @@ def create_dashboard(df):
     
     # Sender Pincode Analysis
     st.subheader("📍 Sender Pincode Analysis")
-    create_pincode_analysis(df, 'Sender Pincode', 'Sender')
+    create_pincode_analysis(df, 'Sender Pincode', 'Sender', filter_key)
     
     st.divider()
     
     # Receiver Pincode Analysis
     st.subheader("📍 Receiver Pincode Analysis")
-    create_pincode_analysis(df, 'Receiver Pincode', 'Receiver')
+    create_pincode_analysis(df, 'Receiver Pincode', 'Receiver', filter_key)
     
     st.divider()
     
@@ -391,84 +717,91 @@ def create_dashboard(df):
     valid_charges = df[df['Numeric_Delivery_Charge'] > 0]['Numeric_Delivery_Charge']
     
     if not valid_charges.empty:
+        # Both charts are drawn from server-side summaries, so the browser gets O(bins) values instead of every row
+        counts, edges, charge_stats = summarize_charges(valid_charges, filter_key)
         col1, col2 = st.columns(2)
         
         with col1:
-            # Histogram of delivery charges
-            fig_hist = px.histogram(
-                valid_charges,
-                nbins=20,
+            # Histogram of delivery charges, pre-binned
+            fig_hist = go.Figure(go.Bar(
+                x=(edges[:-1] + edges[1:]) / 2,
+                y=counts,
+                width=np.diff(edges),
+                marker_color='#1f77b4'
+            ))
+            fig_hist.update_layout(
                 title="Distribution of Delivery Charges",
-                labels={'value': 'Delivery Charge (₹)', 'count': 'Frequency'},
-                color_discrete_sequence=['#1f77b4']
+                xaxis_title="Delivery Charge (₹)",
+                yaxis_title="Frequency",
+                bargap=0
             )
             st.plotly_chart(fig_hist, use_container_width=True)
         
         with col2:
-            # Box plot for delivery charges
-            fig_box = px.box(
-                y=valid_charges,
-                title="Delivery Charges Box Plot",
-                labels={'y': 'Delivery Charge (₹)'}
-            )
+            # Box plot for delivery charges from precomputed quartiles and whiskers
+            fig_box = go.Figure(go.Box(
+                q1=[charge_stats['q1']],
+                median=[charge_stats['median']],
+                q3=[charge_stats['q3']],
+                lowerfence=[charge_stats['lowerfence']],
+                upperfence=[charge_stats['upperfence']],
+                name=""
+            ))
+            fig_box.update_layout(title="Delivery Charges Box Plot", yaxis_title="Delivery Charge (₹)")
             st.plotly_chart(fig_box, use_container_width=True)
         
         # Statistics
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.metric("Average Charge", f"₹{valid_charges.mean():.2f}")
+            st.metric("Average Charge", f"₹{charge_stats['mean']:.2f}")
         with col2:
-            st.metric("Median Charge", f"₹{valid_charges.median():.2f}")
+            st.metric("Median Charge", f"₹{charge_stats['median']:.2f}")
         with col3:
-            st.metric("Min Charge", f"₹{valid_charges.min():.2f}")
+            st.metric("Min Charge", f"₹{charge_stats['min']:.2f}")
         with col4:
-            st.metric("Max Charge", f"₹{valid_charges.max():.2f}")
+            st.metric("Max Charge", f"₹{charge_stats['max']:.2f}")
     
     st.divider()
     
     # Time Series Analysis (if dates are available)
     st.subheader("📅 Time Series Analysis")
     
-    # Convert dates and filter valid ones
-    df_with_dates = df[df['Main Date'] != 'NA'].copy()
-    
-    if not df_with_dates.empty:
+    # Reuse the dates parsed on load; rows without one are left out of the time series
+    if df['Date'].notna().any():
         try:
-            df_with_dates['Date'] = pd.to_datetime(df_with_dates['Main Date'], format='%d-%m-%Y', errors='coerce')
-            df_with_dates = df_with_dates.dropna(subset=['Date'])
+            daily_orders, monthly_summary = summarize_by_date(df, filter_key)
+            
+            # Downsample long histories so the browser only receives MAX_PLOT_POINTS points
+            plot_idx = lttb_indices(daily_orders['Date'].astype('int64'), daily_orders['Orders'], MAX_PLOT_POINTS)
+            fig_line = px.line(
+                daily_orders.iloc[plot_idx],
+                x='Date',
+                y='Orders',
+                title="Orders Over Time",
+                labels={'Date': 'Date', 'Orders': 'Number of Orders'},
+                render_mode='webgl'
+            )
+            st.plotly_chart(fig_line, use_container_width=True)
             
-            if not df_with_dates.empty:
-                # Group by date and count orders
-                daily_orders = df_with_dates.groupby('Date').size().reset_index(name='Orders')
-                
-                fig_line = px.line(
-                    daily_orders,
-                    x='Date',
-                    y='Orders',
-                    title="Orders Over Time",
-                    labels={'Date': 'Date', 'Orders': 'Number of Orders'}
-                )
-                st.plotly_chart(fig_line, use_container_width=True)
-                
-                # Monthly summary
-                df_with_dates['Month'] = df_with_dates['Date'].dt.to_period('M')
-                monthly_summary = df_with_dates.groupby('Month').agg({
-                    'File Name': 'count',
-                    'Numeric_Delivery_Charge': 'sum'
-                }).rename(columns={'File Name': 'Orders', 'Numeric_Delivery_Charge': 'Total_Delivery'})
-                
-                st.write("**Monthly Summary:**")
-                st.dataframe(monthly_summary, use_container_width=True)
+            st.write("**Monthly Summary:**")
+            st.dataframe(monthly_summary, use_container_width=True)
         
         except Exception as e:
             st.warning(f"Could not process dates for time series analysis: {e}")
     
     st.divider()
     
-    # Data Table
+    # Data Table - only the selected page is sent to the browser
     st.subheader("📋 Raw Data")
-    st.dataframe(df, use_container_width=True)
+    total_pages = max(1, -(-len(df) // RAW_DATA_PAGE_SIZE))
+    page = 1
+    if total_pages > 1:
+        page = st.number_input(f"Page (1-{total_pages})", min_value=1, max_value=total_pages, value=1, step=1)
+    start_row = (page - 1) * RAW_DATA_PAGE_SIZE
+    end_row = min(start_row + RAW_DATA_PAGE_SIZE, len(df))
+    st.dataframe(df.iloc[start_row:end_row], use_container_width=True)
+    st.caption(f"Showing rows {start_row + 1}-{end_row} of {len(df)}")
 
 
 # Streamlit UI
@@ -482,96 +815,93 @@ tab1, tab2 = st.tabs(["📤 Upload & Extract", "📊 Dashboard"])
 with tab1:
     st.write("**Upload PDF files or ZIP files containing PDFs to extract invoice number, sender pincode, receiver pincode, delivery/shipment charges, and main date.**")
     uploaded_files = st.file_uploader("Choose PDF or ZIP files", accept_multiple_files=True, type=['pdf', 'zip'])
+    st.number_input("Parallel Gemini requests", min_value=1, max_value=32, value=MAX_WORKERS, step=1, key="workers")
 
     if uploaded_files:
         # Process all uploaded files (PDFs and ZIPs)
-        all_pdf_files = process_uploaded_files(uploaded_files)
+        total_pdfs, pdf_contents = process_uploaded_files(uploaded_files)
         
-        if not all_pdf_files:
+        if not total_pdfs:
             st.error("❌ No PDF files found to process!")
         else:
-            st.info(f"📋 Total PDF files to process: {len(all_pdf_files)}")
+            st.info(f"📋 Total PDF files to process: {total_pdfs}")
             
-            data = []
+            data = {column: [] for column in DATA_COLUMNS}  # built column by column
             skipped_files = []
             progress_bar = st.progress(0)
             status_text = st.empty()
 
-            for i, pdf_file in enumerate(all_pdf_files):
-                file_name = getattr(pdf_file, 'name', f'file_{i+1}.pdf')
-                status_text.text(f"Processing {file_name} ({i+1}/{len(all_pdf_files)})")
-                
-                # Reset file pointer for processing
-                if hasattr(pdf_file, 'seek'):
-                    pdf_file.seek(0)
-                
-                fields = extract_field(pdf_file)
+            max_workers = st.session_state.get("workers", MAX_WORKERS)
+            file_names, results = extract_invoices(pdf_contents, total_pdfs, max_workers, progress_bar, status_text)
 
+            # Invoice numbers already stored (case-insensitive), read once per batch
+            output_file = OUTPUT_DIR
+            existing_df = load_existing_data(output_file, data_file_mtime(output_file))
+            known_invoices = build_invoice_index(existing_df)
+
+            for file_name, fields in zip(file_names, results):
                 invoice_number = fields.get("invoice_number", "NA")
                 sender_pincode = fields.get("sender_pincode", "NA")
                 receiver_pincode = fields.get("receiver_pincode", "NA")
                 delivery_charge = fields.get("delivery_charge", "NA")
                 main_date = fields.get("main_date", "NA")
 
-                # Check for duplicate invoice number
-                output_file = "invoice.xlsx"
-                if check_duplicate_invoice(output_file, invoice_number):
+                # Check for duplicate invoice number, including earlier files in this batch. Missing numbers
+                # (JSON null or any NA token, as in na_mask) never count as duplicates and aren't remembered
+                has_invoice_number = invoice_number is not None and str(invoice_number).strip() not in NA_TOKENS
+                if has_invoice_number and str(invoice_number).upper() in known_invoices:
                     skipped_files.append(f"{file_name} (Invoice: {invoice_number})")
                     st.warning(f"⚠️ Skipped {file_name}: Invoice number '{invoice_number}' already exists!")
                 else:
-                    data.append([file_name, invoice_number, delivery_charge, main_date, sender_pincode, receiver_pincode])
-                
-                progress_bar.progress((i + 1) / len(all_pdf_files))
+                    row = (file_name, invoice_number, delivery_charge, main_date, sender_pincode, receiver_pincode)
+                    for column, value in zip(DATA_COLUMNS, row):
+                        data[column].append(value)
+                    if has_invoice_number:
+                        known_invoices.add(str(invoice_number).upper())
 
             status_text.text("Processing complete!")
             
             # Show summary of processing
-            if data:
-                st.success(f"✅ Successfully processed {len(data)} files!")
+            new_records = len(data['File Name'])
+            if new_records:
+                st.success(f"✅ Successfully processed {new_records} files!")
             
             if skipped_files:
                 st.warning(f"⚠️ Skipped {len(skipped_files)} duplicate files:")
                 for skipped in skipped_files:
                     st.write(f"- {skipped}")
             
-            if data:
-                df = pd.DataFrame(data, columns=['File Name', 'Invoice Number', 'Delivery/Shipment Charges', 'Main Date', 'Sender Pincode', 'Receiver Pincode'])
+            if new_records:
+                df = pd.DataFrame(data)
 
                 st.write("**Extracted Data (New Records Only):**")
                 st.dataframe(df, use_container_width=True)
 
-                final_df = append_to_file(output_file, df)
-
-                # Check which file was actually created/updated
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                backup_filename = f"invoice_backup_{timestamp}.xlsx"
-                
-                download_filename = output_file if os.path.exists(output_file) else backup_filename
-                
-                if os.path.exists(download_filename):
-                    with open(download_filename, "rb") as f:
-                        st.download_button(
-                            label="📥 Download as Excel",
-                            data=f,
-                            file_name=download_filename,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
-                
-                st.info("💡 Data has been added to the Excel file. Check the Dashboard tab to see updated analytics!")
-                
-                # Show file status
-                if os.path.exists(output_file):
+                # append_to_file reports any error writing the part; nothing is offered for download then
+                if append_to_file(output_file, df):
+                    # Export the full history to Excel in memory - nothing is written to or re-read from disk.
+                    # This load is cached and reused by the dashboard tab below. The fallback frame of a failed
+                    # read has no parsed Date column, hence errors='ignore'.
+                    final_df = load_existing_data(output_file, data_file_mtime(output_file))
+                    excel_buffer = io.BytesIO()
+                    final_df.drop(columns='Date', errors='ignore').to_excel(excel_buffer, index=False, engine='xlsxwriter')
+                    st.download_button(
+                        label="📥 Download as Excel",
+                        data=excel_buffer.getvalue(),
+                        file_name=f"{os.path.basename(output_file)}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+                    
+                    st.info("💡 Data has been added to the invoice data file. Check the Dashboard tab to see updated analytics!")
                     st.success(f"✅ Data successfully saved to: {output_file}")
-                elif os.path.exists(backup_filename):
-                    st.warning(f"⚠️ Original file was locked, data saved to: {backup_filename}")
-                    st.info("💡 To merge with your main file, close Excel and run the upload again.")
             else:
                 st.info("ℹ️ No new records to add. All files were either duplicates or had processing errors.")
 
 with tab2:
     # Load existing data for dashboard
-    output_file = "invoice.xlsx"
-    existing_df = load_existing_data(output_file)
+    output_file = OUTPUT_DIR
+    data_cache_key = (output_file, data_file_mtime(output_file))
+    existing_df = load_existing_data(*data_cache_key)
     
     # Add refresh button and PDF download
     col1, col2 = st.columns([1, 1])
@@ -587,29 +917,23 @@ with tab2:
                     start_date = None
                     end_date = None
                     
-                    # Check if date filtering was applied
-                    df_with_valid_dates = existing_df[existing_df['Main Date'] != 'NA'].copy()
-                    if not df_with_valid_dates.empty:
-                        try:
-                            df_with_valid_dates['Date'] = pd.to_datetime(df_with_valid_dates['Main Date'], format='%d-%m-%Y', errors='coerce')
-                            df_with_valid_dates = df_with_valid_dates.dropna(subset=['Date'])
-                            if not df_with_valid_dates.empty:
-                                start_date = df_with_valid_dates['Date'].min().strftime('%d-%m-%Y')
-                                end_date = df_with_valid_dates['Date'].max().strftime('%d-%m-%Y')
-                        except:
-                            pass
+                    # Report period from the dates parsed on load (shared with the dashboard)
+                    report_dates = existing_df['Date'].dropna()
+                    if not report_dates.empty:
+                        start_date = report_dates.min().strftime('%d-%m-%Y')
+                        end_date = report_dates.max().strftime('%d-%m-%Y')
                     
                     # Generate PDF
-                    pdf = generate_pdf_report(existing_df, start_date, end_date)
+                    from pdf_report_generator import generate_pdf_report
+                    pdf = generate_pdf_report(existing_df, start_date, end_date, cache_key=data_cache_key)
                     
                     if pdf:
                         # Create filename with timestamp
                         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
                         filename = f"invoice_analysis_report_{timestamp}.pdf"
                         
-                        # Convert bytearray to bytes for Streamlit download_button
-                        pdf_bytearray = pdf.output()
-                        pdf_bytes = bytes(pdf_bytearray)
+                        # Serialize once; download_button sends the bytes as-is (no base64 data: URI)
+                        pdf_bytes = bytes(pdf.output())
                         
                         # Provide download button
                         st.download_button(
@@ -625,4 +949,4 @@ with tab2:
                 except Exception as e:
                     st.error(f"❌ Error generating PDF: {str(e)}")
     
-    create_dashboard(existing_df)
\ No newline at end of file
+    create_dashboard(existing_df, data_cache_key)
\ No newline at end of file
@@ -1,63 +1,113 @@
+import hashlib
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from fpdf import FPDF
-import plotly.graph_objects as go
-import plotly.express as px
 from datetime import datetime
-import tempfile
-import os
-import base64
 import streamlit as st
+from invoice_fields import NA_TOKENS, NUMBER_PATTERN
+
+# Delivery charge ranges in the distribution section: upper bounds of the right-closed bins below
+# "Above Rs.500" (only positive charges are binned)
+CHARGE_RANGE_EDGES = np.array([50, 100, 200, 500], dtype=np.float32)
+CHARGE_RANGE_LABELS = ['Rs.0 - Rs.50', 'Rs.51 - Rs.100', 'Rs.101 - Rs.200', 'Rs.201 - Rs.500', 'Above Rs.500']
+
+# Report cache bounds: each entry holds full-length charges, so keep only the current and previous data version
+REPORT_CACHE_ENTRIES = 2
+
+# Text columns the report reads, converted once to Arrow-backed strings on entry
+REPORT_TEXT_COLUMNS = ['Delivery/Shipment Charges', 'Main Date', 'Sender Pincode', 'Receiver Pincode']
+REPORT_STRING_DTYPE = 'string[pyarrow]'
+
+# Metrics reported when there are no delivery charges to summarize
+_EMPTY_METRICS = {
+    'total_delivery_spent': 0.0,
+    'total_orders': 0,
+    'na_count': 0,
+    'na_percentage': 0,
+    'avg_charge': 0,
+    'median_charge': 0,
+    'min_charge': 0,
+    'max_charge': 0
+}
+
+# ASCII replacements for Unicode characters the built-in fonts can't encode, applied in one str.translate pass
+_SAFE_TEXT_TABLE = str.maketrans({
+    '₹': 'Rs.',
+    '\u2013': '-',      # en dash
+    '\u2014': '--',     # em dash
+    '\u2018': "'",      # curly single quotes
+    '\u2019': "'",
+    '\u201c': '"',      # curly double quotes
+    '\u201d': '"',
+    '\u2026': '...',    # ellipsis
+    '\u2022': '*',      # bullet
+    '€': 'EUR',
+    '£': 'GBP',
+    '$': 'USD'
+})
 
 class InvoiceReportPDF(FPDF):
+    # Set by __init__ when no Unicode font could be loaded
+    unicode_fallback = False
+    
+    # Unicode font picked by the first instance as (family, regular file, bold file), or None to use the
+    # built-in fallback. Later instances reuse the choice instead of retrying fonts that failed to load.
+    _unicode_font = None
+    _font_resolved = False
+    
     def __init__(self):
         super().__init__()
         self.set_auto_page_break(auto=True, margin=15)
         
         # Add Unicode font support
-        try:
-            # Try to use DejaVu Sans (commonly available)
-            self.add_font('DejaVu', '', 'DejaVuSans.ttf')
-            self.add_font('DejaVu', 'B', 'DejaVuSans-Bold.ttf')
-            self.font_family = 'DejaVu'
-        except:
+        cls = type(self)
+        if not cls._font_resolved:
+            cls._unicode_font = self._register_unicode_font()
+            cls._font_resolved = True
+        elif cls._unicode_font:
+            family, regular, bold = cls._unicode_font
+            self.add_font(family, '', regular)
+            self.add_font(family, 'B', bold)
+        
+        if cls._unicode_font:
+            self.font_family = cls._unicode_font[0]
+        else:
+            # Final fallback - use built-in fonts but replace Unicode chars
+            self.font_family = 'Arial'
+            self.unicode_fallback = True
+        
+        # Pick the text converter once instead of checking the fallback flag on every cell
+        self.safe_text = self._safe_text_fallback if self.unicode_fallback else self._safe_text_identity
+    
+    def _register_unicode_font(self):
+        """Register the first Unicode font that loads and return (family, regular file, bold file), or None."""
+        import platform
+        # Try DejaVu Sans (commonly available), then a system font
+        candidates = [('DejaVu', 'DejaVuSans.ttf', 'DejaVuSans-Bold.ttf')]
+        if platform.system() == "Windows":
+            candidates.append(('Arial', 'arial.ttf', 'arialbd.ttf'))
+        else:
+            # For Linux/Mac, try common Unicode fonts
+            candidates.append(('Liberation', 'LiberationSans-Regular.ttf', 'LiberationSans-Bold.ttf'))
+        
+        for family, regular, bold in candidates:
             try:
-                # Fallback to system fonts
-                import platform
-                if platform.system() == "Windows":
-                    self.add_font('Arial', '', 'arial.ttf')
-                    self.add_font('Arial', 'B', 'arialbd.ttf')
-                    self.font_family = 'Arial'
-                else:
-                    # For Linux/Mac, try common Unicode fonts
-                    self.add_font('Liberation', '', 'LiberationSans-Regular.ttf')
-                    self.add_font('Liberation', 'B', 'LiberationSans-Bold.ttf')
-                    self.font_family = 'Liberation'
-            except:
-                # Final fallback - use built-in fonts but replace Unicode chars
-                self.font_family = 'Arial'
-                self.unicode_fallback = True
-    
-    def safe_text(self, text):
-        """Convert Unicode characters to safe alternatives for non-Unicode fonts."""
-        if hasattr(self, 'unicode_fallback') and self.unicode_fallback:
-            # Replace common Unicode characters with ASCII alternatives
-            replacements = {
-                '₹': 'Rs.',
-                '–': '-',
-                '—': '--',
-                ''': "'",
-                ''': "'",
-                '"': '"',
-                '"': '"',
-                '…': '...',
-                '•': '*',
-                '€': 'EUR',
-                '£': 'GBP',
-                '$': 'USD'
-            }
-            for unicode_char, ascii_char in replacements.items():
-                text = text.replace(unicode_char, ascii_char)
-        return str(text)
+                self.add_font(family, '', regular)
+                self.add_font(family, 'B', bold)
+                return family, regular, bold
+            except Exception:
+                continue
+        return None
+    
+    def _safe_text_identity(self, text):
+        """Text as-is for Unicode fonts; bound as safe_text by __init__."""
+        return text if isinstance(text, str) else str(text)
+    
+    def _safe_text_fallback(self, text):
+        """Convert Unicode characters to safe alternatives for non-Unicode fonts; bound as safe_text by __init__."""
+        return str(text).translate(_SAFE_TEXT_TABLE)
     
     def header(self):
         self.set_font(self.font_family, 'B', 16)
@@ -71,38 +121,55 @@ class InvoiceReportPDF(FPDF):
         self.set_font(self.font_family, 'I', 8)
         self.cell(0, 10, self.safe_text(f'Page {self.page_no()}'), 0, 0, 'C')
 
-def extract_numeric_value(delivery_charge):
-    """Extract numeric value from delivery charge string."""
-    if pd.isna(delivery_charge) or delivery_charge == "NA":
-        return 0
-    
-    import re
-    delivery_str = str(delivery_charge)
-    numbers = re.findall(r'\d+\.?\d*', delivery_str)
-    if numbers:
-        return float(numbers[0])
-    return 0
+def _clean_mask(series):
+    """Return (stripped string values, missing mask) for a column, stripping it only once.
+    
+    Missing means null or one of the NA tokens, the same rule as the dashboard's na_mask.
+    """
+    stripped = series.astype(REPORT_STRING_DTYPE).str.strip()
+    na_mask = stripped.isna() | stripped.isin(NA_TOKENS)
+    return stripped, na_mask
+
+def _first_numbers(strings):
+    """Return the first number in each string as float32, 0 where there is none.
+    
+    Runs pyarrow's compiled (RE2) regex kernel over the whole column; pandas' str.extract calls Python's re per value.
+    Delivery charges are small amounts, so float32 holds them exactly enough and halves the bytes every later pass reads.
+    """
+    matches = pc.extract_regex(pa.array(strings, type=pa.string(), from_pandas=True), NUMBER_PATTERN)
+    numbers = pc.cast(pc.struct_field(matches, [0]), pa.float32()).to_numpy(zero_copy_only=False)
+    return pd.Series(pd.array(numbers, dtype='Float32'), index=strings.index).fillna(0.0)
 
-def create_summary_metrics(df):
-    """Calculate summary metrics from the dataframe."""
-    df['Numeric_Delivery_Charge'] = df['Delivery/Shipment Charges'].apply(extract_numeric_value)
-    
-    total_delivery_spent = df['Numeric_Delivery_Charge'].sum()
-    na_count = ((df['Delivery/Shipment Charges'] == 'NA') | 
-                (df['Delivery/Shipment Charges'].isna()) | 
-                (df['Delivery/Shipment Charges'] == '') |
-                (df['Delivery/Shipment Charges'].astype(str).str.strip() == 'NA')).sum()
-    total_orders = len(df)
+@st.cache_data(show_spinner=False, max_entries=REPORT_CACHE_ENTRIES)
+def create_summary_metrics(_df, cache_key):
+    """Calculate summary metrics from the dataframe. Returns (metrics, numeric delivery charges as a float32 array).
+    
+    cache_key identifies _df, so reporting the same data again skips the parsing without hashing the frame.
+    """
+    if _df.empty or 'Delivery/Shipment Charges' not in _df:
+        return dict(_EMPTY_METRICS, total_orders=len(_df)), np.zeros(len(_df), dtype=np.float32)
+    
+    charges, charges_na = _clean_mask(_df['Delivery/Shipment Charges'])
+    # One vectorized regex pass over the column; missing or non-numeric charges count as 0
+    numeric_charges = _first_numbers(charges)
+    
+    charges_array = numeric_charges.to_numpy(dtype=np.float32)
+    # Accumulate in float64 so totals over many rows don't drift
+    total_delivery_spent = charges_array.sum(dtype=np.float64)
+    na_count = int(charges_na.sum())
+    total_orders = len(_df)
     na_percentage = (na_count / total_orders * 100) if total_orders > 0 else 0
     
-    # Valid charges statistics
-    valid_charges = df[df['Numeric_Delivery_Charge'] > 0]['Numeric_Delivery_Charge']
-    avg_charge = valid_charges.mean() if not valid_charges.empty else 0
-    median_charge = valid_charges.median() if not valid_charges.empty else 0
-    min_charge = valid_charges.min() if not valid_charges.empty else 0
-    max_charge = valid_charges.max() if not valid_charges.empty else 0
+    # Valid charges statistics on the raw array, with one empty check
+    valid_charges = charges_array[charges_array > 0]
+    avg_charge = median_charge = min_charge = max_charge = 0
+    if valid_charges.size:
+        avg_charge = valid_charges.mean(dtype=np.float64)
+        median_charge = np.median(valid_charges)
+        min_charge = valid_charges.min()
+        max_charge = valid_charges.max()
     
-    return {
+    metrics = {
         'total_delivery_spent': total_delivery_spent,
         'total_orders': total_orders,
         'na_count': na_count,
@@ -112,27 +179,44 @@ def create_summary_metrics(df):
         'min_charge': min_charge,
         'max_charge': max_charge
     }
+    return metrics, charges_array
 
-def get_pincode_analysis(df, pincode_column):
-    """Get pincode analysis for sender or receiver."""
-    valid_pincodes_mask = ((df[pincode_column] != 'NA') & 
-                          (~df[pincode_column].isna()) & 
-                          (df[pincode_column] != '') &
-                          (df[pincode_column].astype(str).str.strip() != 'NA'))
-    valid_pincodes = df[valid_pincodes_mask][pincode_column]
+# Two entries (sender and receiver) per data version
+@st.cache_data(show_spinner=False, max_entries=2 * REPORT_CACHE_ENTRIES)
+def get_pincode_analysis(_df, pincode_column, cache_key):
+    """Get pincode analysis for sender or receiver. cache_key identifies _df."""
+    if pincode_column not in _df or _df[pincode_column].isna().all():
+        return pd.Series(dtype='int64')
+    
+    pincodes, pincodes_na = _clean_mask(_df[pincode_column])
+    valid_pincodes = pincodes[~pincodes_na]
     
     if not valid_pincodes.empty:
-        valid_pincodes = valid_pincodes.astype(str).str.strip()
-        pincode_counts = valid_pincodes.value_counts()
-        return pincode_counts.head(10)  # Top 10
-    return pd.Series()
+        # Only the top 10 are needed, so select them with nlargest instead of sorting every pincode
+        return valid_pincodes.value_counts(sort=False).nlargest(10)
+    return pd.Series(dtype='int64')
 
-def generate_pdf_report(df, start_date=None, end_date=None):
-    """Generate a comprehensive PDF report from the dataframe."""
+def generate_pdf_report(df, start_date=None, end_date=None, cache_key=None):
+    """Generate a comprehensive PDF report from the dataframe.
+    
+    cache_key identifies df for the report caches (the dashboard passes its (path, mtime) data key).
+    Without one, the frame's contents are hashed to build the key.
+    """
     
     if df.empty:
         return None
     
+    if cache_key is None:
+        cache_key = hashlib.blake2b(pd.util.hash_pandas_object(df).to_numpy().tobytes(), digest_size=16).hexdigest()
+    
+    # Work on Arrow-backed copies of just the columns the report reads, so every string op below runs in
+    # Arrow kernels without per-cell Python objects. The caller's frame is not modified.
+    # Missing columns are skipped; the sections below report them as having no data
+    report_columns = {column: df[column].astype(REPORT_STRING_DTYPE) for column in REPORT_TEXT_COLUMNS if column in df}
+    if 'Date' in df:
+        report_columns['Date'] = df['Date']
+    df = pd.DataFrame(report_columns, index=df.index)
+    
     # Create PDF instance
     pdf = InvoiceReportPDF()
     pdf.add_page()
@@ -148,7 +232,8 @@ def generate_pdf_report(df, start_date=None, end_date=None):
         pdf.ln(5)
     
     # Summary Metrics
-    metrics = create_summary_metrics(df)
+    # Parsed charges stay a local array rather than a new column on df
+    metrics, numeric_charges = create_summary_metrics(df, cache_key)
     
     pdf.set_font(pdf.font_family, 'B', 12)
     pdf.cell(0, 10, pdf.safe_text('Key Metrics'), 0, 1, 'L')
@@ -172,22 +257,17 @@ def generate_pdf_report(df, start_date=None, end_date=None):
     pdf.ln(10)
     
     # Delivery Charges Distribution Analysis
-    valid_charges = df[df['Numeric_Delivery_Charge'] > 0]['Numeric_Delivery_Charge']
-    if not valid_charges.empty:
+    valid_charges = numeric_charges[numeric_charges > 0]
+    if valid_charges.size:
         pdf.set_font(pdf.font_family, 'B', 12)
         pdf.cell(0, 10, pdf.safe_text('Delivery Charges Distribution'), 0, 1, 'L')
         pdf.set_font(pdf.font_family, '', 10)
         
-        # Calculate charge ranges
-        charge_ranges = [
-            ('Rs.0 - Rs.50', len(valid_charges[(valid_charges >= 0) & (valid_charges <= 50)])),
-            ('Rs.51 - Rs.100', len(valid_charges[(valid_charges > 50) & (valid_charges <= 100)])),
-            ('Rs.101 - Rs.200', len(valid_charges[(valid_charges > 100) & (valid_charges <= 200)])),
-            ('Rs.201 - Rs.500', len(valid_charges[(valid_charges > 200) & (valid_charges <= 500)])),
-            ('Above Rs.500', len(valid_charges[valid_charges > 500]))
-        ]
+        # Count all charge ranges in one pass: side='left' keeps the bins right-closed, so 50 falls in Rs.0 - Rs.50
+        range_index = np.searchsorted(CHARGE_RANGE_EDGES, valid_charges, side='left')
+        range_counts = np.bincount(range_index, minlength=len(CHARGE_RANGE_LABELS))
         
-        for range_text, count in charge_ranges:
+        for range_text, count in zip(CHARGE_RANGE_LABELS, range_counts):
             if count > 0:
                 percentage = (count / len(valid_charges)) * 100
                 pdf.cell(0, 6, pdf.safe_text(f"{range_text}: {count} orders ({percentage:.1f}%)"), 0, 1, 'L')
@@ -199,7 +279,7 @@ def generate_pdf_report(df, start_date=None, end_date=None):
     pdf.cell(0, 10, pdf.safe_text('Top Sender Pincodes'), 0, 1, 'L')
     pdf.set_font(pdf.font_family, '', 10)
     
-    sender_pincodes = get_pincode_analysis(df, 'Sender Pincode')
+    sender_pincodes = get_pincode_analysis(df, 'Sender Pincode', cache_key)
     if not sender_pincodes.empty:
         for i, (pincode, count) in enumerate(sender_pincodes.head(10).items(), 1):
             percentage = (count / len(df)) * 100
@@ -214,7 +294,7 @@ def generate_pdf_report(df, start_date=None, end_date=None):
     pdf.cell(0, 10, pdf.safe_text('Top Receiver Pincodes'), 0, 1, 'L')
     pdf.set_font(pdf.font_family, '', 10)
     
-    receiver_pincodes = get_pincode_analysis(df, 'Receiver Pincode')
+    receiver_pincodes = get_pincode_analysis(df, 'Receiver Pincode', cache_key)
     if not receiver_pincodes.empty:
         for i, (pincode, count) in enumerate(receiver_pincodes.head(10).items(), 1):
             percentage = (count / len(df)) * 100
@@ -225,27 +305,29 @@ def generate_pdf_report(df, start_date=None, end_date=None):
     pdf.ln(10)
     
     # Monthly Analysis (if dates are available)
-    df_with_dates = df[df['Main Date'] != 'NA'].copy()
-    if not df_with_dates.empty:
-        try:
-            df_with_dates['Date'] = pd.to_datetime(df_with_dates['Main Date'], format='%d-%m-%Y', errors='coerce')
-            df_with_dates = df_with_dates.dropna(subset=['Date'])
+    try:
+        # Reuse dates parsed by the caller's loader if present; otherwise parse once (cache=True parses each distinct date string once)
+        if 'Date' in df:
+            dates = df['Date']
+        else:
+            dates = pd.to_datetime(df['Main Date'], format='%d-%m-%Y', errors='coerce', cache=True)
+        dated = dates.notna()
+        
+        if dated.any():
+            pdf.set_font(pdf.font_family, 'B', 12)
+            pdf.cell(0, 10, pdf.safe_text('Monthly Summary'), 0, 1, 'L')
+            pdf.set_font(pdf.font_family, '', 10)
+            
+            # Group the dated rows by month directly, without copying the frame to add a Month column
+            months = dates[dated].dt.to_period('M')
+            # Orders are the group sizes, so only the numeric charge column is read
+            monthly_charges = pd.Series(numeric_charges[dated.to_numpy()], index=months.index).groupby(months)
+            monthly_summary = pd.DataFrame({'Orders': monthly_charges.size(), 'Total_Delivery': monthly_charges.sum()})
             
-            if not df_with_dates.empty:
-                pdf.set_font(pdf.font_family, 'B', 12)
-                pdf.cell(0, 10, pdf.safe_text('Monthly Summary'), 0, 1, 'L')
-                pdf.set_font(pdf.font_family, '', 10)
-                
-                df_with_dates['Month'] = df_with_dates['Date'].dt.to_period('M')
-                monthly_summary = df_with_dates.groupby('Month').agg({
-                    'File Name': 'count',
-                    'Numeric_Delivery_Charge': 'sum'
-                }).rename(columns={'File Name': 'Orders', 'Numeric_Delivery_Charge': 'Total_Delivery'})
-                
-                for month, row in monthly_summary.iterrows():
-                    pdf.cell(0, 6, pdf.safe_text(f"{month}: {row['Orders']} orders, Rs.{row['Total_Delivery']:.2f} total delivery"), 0, 1, 'L')
-        except:
-            pass
+            for month, orders, total_delivery in zip(monthly_summary.index, monthly_summary['Orders'], monthly_summary['Total_Delivery']):
+                pdf.cell(0, 6, pdf.safe_text(f"{month}: {orders} orders, Rs.{total_delivery:.2f} total delivery"), 0, 1, 'L')
+    except:
+        pass
     
     pdf.ln(10)
     
@@ -254,34 +336,31 @@ def generate_pdf_report(df, start_date=None, end_date=None):
     pdf.cell(0, 10, pdf.safe_text('Key Insights'), 0, 1, 'L')
     pdf.set_font(pdf.font_family, '', 10)
     
-    insights = []
-    
-    # Data quality insight
-    if metrics['na_percentage'] > 20:
-        insights.append(f"• High percentage of missing delivery charges ({metrics['na_percentage']:.1f}%) - consider data quality improvement")
-    elif metrics['na_percentage'] < 5:
-        insights.append(f"• Excellent data quality with only {metrics['na_percentage']:.1f}% missing delivery charges")
-    
-    # Cost insights
-    if metrics['avg_charge'] > 0:
-        insights.append(f"• Average delivery cost is Rs.{metrics['avg_charge']:.2f} per order")
-        if metrics['max_charge'] > metrics['avg_charge'] * 3:
-            insights.append(f"• Some orders have unusually high delivery charges (max: Rs.{metrics['max_charge']:.2f})")
-    
-    # Volume insights
-    if not sender_pincodes.empty:
-        top_sender = sender_pincodes.index[0]
-        top_sender_count = sender_pincodes.iloc[0]
-        sender_percentage = (top_sender_count / len(df)) * 100
-        if sender_percentage > 30:
-            insights.append(f"• High concentration from sender pincode {top_sender} ({sender_percentage:.1f}% of orders)")
-    
-    if not receiver_pincodes.empty:
-        top_receiver = receiver_pincodes.index[0]
-        top_receiver_count = receiver_pincodes.iloc[0]
-        receiver_percentage = (top_receiver_count / len(df)) * 100
-        if receiver_percentage > 30:
-            insights.append(f"• High concentration to receiver pincode {top_receiver} ({receiver_percentage:.1f}% of orders)")
+    # Top pincode shares as plain floats, read once from the pincode analyses above
+    top_sender = sender_pincodes.index[0] if not sender_pincodes.empty else None
+    top_receiver = receiver_pincodes.index[0] if not receiver_pincodes.empty else None
+    metrics['top_sender_pct'] = float(sender_pincodes.iloc[0] / len(df) * 100) if top_sender is not None else 0.0
+    metrics['top_receiver_pct'] = float(receiver_pincodes.iloc[0] / len(df) * 100) if top_receiver is not None else 0.0
+    
+    # (condition, message) rules in display order; a message is only formatted when its condition holds
+    insight_rules = [
+        # Data quality insight
+        (metrics['na_percentage'] > 20,
+         lambda: f"• High percentage of missing delivery charges ({metrics['na_percentage']:.1f}%) - consider data quality improvement"),
+        (metrics['na_percentage'] < 5,
+         lambda: f"• Excellent data quality with only {metrics['na_percentage']:.1f}% missing delivery charges"),
+        # Cost insights
+        (metrics['avg_charge'] > 0,
+         lambda: f"• Average delivery cost is Rs.{metrics['avg_charge']:.2f} per order"),
+        (metrics['avg_charge'] > 0 and metrics['max_charge'] > metrics['avg_charge'] * 3,
+         lambda: f"• Some orders have unusually high delivery charges (max: Rs.{metrics['max_charge']:.2f})"),
+        # Volume insights
+        (metrics['top_sender_pct'] > 30,
+         lambda: f"• High concentration from sender pincode {top_sender} ({metrics['top_sender_pct']:.1f}% of orders)"),
+        (metrics['top_receiver_pct'] > 30,
+         lambda: f"• High concentration to receiver pincode {top_receiver} ({metrics['top_receiver_pct']:.1f}% of orders)"),
+    ]
+    insights = [message() for condition, message in insight_rules if condition]
     
     # Add insights to PDF
     for insight in insights[:6]:  # Limit to 6 insights to fit on page
@@ -297,8 +376,3 @@ def generate_pdf_report(df, start_date=None, end_date=None):
     pdf.cell(0, 6, pdf.safe_text("Note: Detailed data can be downloaded separately as Excel/CSV format from the dashboard."), 0, 1, 'L')
     
     return pdf
-
-def create_download_link(pdf_content, filename):
-    """Create a download link for the PDF."""
-    b64 = base64.b64encode(pdf_content).decode()
-    return f'<a href="data:application/pdf;base64,{b64}" download="{filename}">Download PDF Report</a>'